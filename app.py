@@ -1,12 +1,90 @@
 import gradio as gr
 import os
-import requests
+import json
+import time
+import asyncio
+import functools
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+import httpx
 import re
+from contextlib import closing
 
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 MODEL_NAME = "llama-3.1-8b-instant"
+_MAX_HISTORY_TOKENS = 2000
+
+_BASE_HEADERS = {
+    "Authorization": f"Bearer {GROQ_API_KEY}",
+    "Content-Type": "application/json"
+}
+
+# shared keep-alive client so handlers await the network instead of holding a worker thread
+_ACLIENT = httpx.AsyncClient(
+    headers=_BASE_HEADERS,
+    timeout=30.0,
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+    )
+)
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_MAX_RETRIES = 2
+
+async def _send_groq(request):
+    # the transport only retries failed connects, so transient Groq statuses are retried here
+    for attempt in range(_MAX_RETRIES + 1):
+        response = await _ACLIENT.send(request, stream=True)
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            return response
+        await response.aclose()
+        await asyncio.sleep(0.2 * 2 ** attempt)
+
+# completed replies keyed on the prompt, evicted least-recently-used past _CACHE_MAX_ROWS
+_CACHE_PATH = ".cache.db"
+_CACHE_MAX_ROWS = int(os.environ.get("SCRIPT_CACHE_MAX_ROWS", "256"))
+
+def _cache_connect():
+    conn = sqlite3.connect(_CACHE_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, reply TEXT, ts REAL)")
+    return conn
+
+def _cache_key(topic, tone, duration, hook_strength, history):
+    payload = json.dumps({
+        "m": MODEL_NAME,
+        "t": topic,
+        "to": tone,
+        "d": duration,
+        "temp": round(hook_strength, 2),
+        "h": history
+    }, sort_keys=True)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def _cache_get(key):
+    try:
+        with closing(_cache_connect()) as conn, conn:
+            row = conn.execute("SELECT reply FROM cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE cache SET ts = ? WHERE key = ?", (time.time(), key))
+            return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+def _cache_put(key, reply):
+    try:
+        with closing(_cache_connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, reply, ts) VALUES (?, ?, ?)", (key, reply, time.time()))
+            conn.execute(
+                "DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY ts DESC LIMIT ?)",
+                (_CACHE_MAX_ROWS,)
+            )
+    except sqlite3.Error:
+        pass
 
 SYSTEM_PROMPT = """You are 'ScriptForge AI', a professional YouTube Script Writer.
 Your goal is to write highly engaging scripts in the 2nd person (using 'You', 'Your').
@@ -22,105 +100,206 @@ FORMATTING RULES (STRICT):
    [AUDIO]
    Today is going to be amazing.
 """
+_SYS_MSG = {"role": "system", "content": SYSTEM_PROMPT}
 
-def parse_script(full_text):
-   
-    full_text = re.sub(r'\[?(?:SCENE DESCRIPTION|SCENE|VISUALS)\]?:?', '[VISUAL]', full_text, flags=re.IGNORECASE)
-    full_text = re.sub(r'\[?(?:SCRIPT|NARRATION|AUDIO)\]?:?', '[AUDIO]', full_text, flags=re.IGNORECASE)
-    
+# every tag spelling the model uses, bucketed by group name so one scan finds all sections
+_TAG_RE = re.compile(
+    r'(?P<VISUAL>\[?(?:SCENE DESCRIPTION|SCENE|VISUALS)\]?:?|\[VISUAL\])'
+    r'|(?P<AUDIO>\[?(?:SCRIPT|NARRATION|AUDIO)\]?:?)',
+    re.IGNORECASE
+)
+# longest tag spelling; a match this far from the end of a streamed buffer can no longer change
+_MAX_TAG_LEN = len("[SCENE DESCRIPTION]:")
+# seconds between UI updates while a reply is streaming
+_STREAM_YIELD_INTERVAL = 0.2
+# stage directions, markdown headers and "Host:" style prefixes, stripped in one pass
+_AUDIO_CLEAN_RE = re.compile(r'\([^)]*\)|^#+.*$|^\w+:\s*', re.MULTILINE)
+_STAR_TABLE = str.maketrans('', '', '*')
 
-    parts = re.split(r'(\[(?:VISUAL|AUDIO)\])', full_text, flags=re.IGNORECASE)
+def _iter_sections(text):
+    # yields (tag, body) pairs without building a list of matches; tag is None before the first one
+    current_tag = None
+    i = 0
+    while True:
+        match = _TAG_RE.search(text, i)
+        if not match:
+            yield current_tag, text[i:]
+            return
+        yield current_tag, text[i:match.start()]
+        current_tag = match.lastgroup
+        i = match.end()
+
+def _add_section(tag, part, clean_audio, clean_visuals):
+    part = part.strip()
+    if not part:
+        return
     
+    if tag == "AUDIO":
+       
+        content = _AUDIO_CLEAN_RE.sub('', part)
+     
+        content = content.translate(_STAR_TABLE).strip()
+        
+        if content:
+            clean_audio.append(content)
+            
+    elif tag == "VISUAL":
+        clean_visuals.append(part)
+
+@functools.lru_cache(maxsize=128)
+def parse_script(full_text):
+   
     clean_audio = []
     clean_visuals = []
     
-    current_tag = None
-    
-    for part in parts:
-        part = part.strip()
-        if not part:
+    for current_tag, part in _iter_sections(full_text):
+        if current_tag is None:
             continue
-            
-        if part.upper() == "[AUDIO]":
-            current_tag = "AUDIO"
-        elif part.upper() == "[VISUAL]":
-            current_tag = "VISUAL"
-        elif current_tag == "AUDIO":
-           
-            content = re.sub(r'\(.*?\)', '', part, flags=re.DOTALL)
-          
-            content = re.sub(r'^#+.*$', '', content, flags=re.MULTILINE)
-           
-            content = re.sub(r'^\w+:\s*', '', content, flags=re.MULTILINE)
-         
-            content = content.replace("**", "").replace("*", "")
-            
-            if content.strip():
-                clean_audio.append(content.strip())
-                
-        elif current_tag == "VISUAL":
-            clean_visuals.append(part.strip())
+        _add_section(current_tag, part, clean_audio, clean_visuals)
             
    
     if not clean_audio and not clean_visuals:
-        lines = full_text.split('\n')
+        lines = _TAG_RE.sub(lambda m: f"[{m.lastgroup}]", full_text).splitlines()
         for line in lines:
             line = line.strip()
             if not line: continue
-            if line.startswith('(') or line.startswith('[') or "EXT." in line or "INT." in line:
+            if line.startswith(('(', '[')) or "EXT." in line or "INT." in line:
                 clean_visuals.append(line)
             else:
                 clean_audio.append(line)
 
     return "\n\n".join(clean_audio), "\n\n".join(clean_visuals)
 
-def save_to_file(script_text):
+def _remove_download(file_path):
+    if file_path:
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+def save_to_file(script_text, previous_path):
+    # gradio has already copied the previous download into its own cache, so our copy can go
+    _remove_download(previous_path)
     if not script_text:
-        return None
-    file_path = "youtube_script.txt"
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(script_text)
-    return file_path
+        return None, None
+    # fresh directory per download so concurrent users don't overwrite each other but the file name stays the same
+    file_path = os.path.join(tempfile.mkdtemp(), "youtube_script.txt")
+    with open(file_path, "wb") as f:
+        f.write(script_text.encode("utf-8"))
+    return file_path, file_path
 
-def query_groq(topic, tone, duration, hook_strength, chat_history):
-    if not GROQ_API_KEY:
-        return "Error: GROQ_API_KEY not found in environment secrets. Please add it in Settings > Secrets.", "", ""
+def _trim_history(chat_history):
+    # newest turns first until the rough token budget (about 4 chars per token) runs out
+    budget = _MAX_HISTORY_TOKENS
+    trimmed = []
+    for message in reversed(chat_history):
+        budget -= len(message["content"]) // 4
+        if budget < 0:
+            break
+        trimmed.append(message)
+    trimmed.reverse()
+    return trimmed
 
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
+async def query_groq(topic, tone, duration, hook_strength, chat_history, bypass_cache=False):
+    history = _trim_history(chat_history)
+    cache_key = _cache_key(topic, tone, duration, hook_strength, history)
     
+    if not bypass_cache:
+        cached = await asyncio.to_thread(_cache_get, cache_key)
+        if cached is not None:
+            yield cached, "", ""
+            tts_script, scenes = await asyncio.to_thread(parse_script, cached)
+            yield cached, tts_script, scenes
+            return
+
+    if not GROQ_API_KEY:
+        yield "Error: GROQ_API_KEY not found in environment secrets. Please add it in Settings > Secrets.", "", ""
+        return
+
     user_input = f"Topic: {topic}\nTone: {tone}\nTarget Duration: {duration}\nAction: Write a full YouTube script."
     
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-   
-    messages.extend(chat_history[-6:])
-    
-    messages.append({"role": "user", "content": user_input})
+    messages = [_SYS_MSG, *history, {"role": "user", "content": user_input}]
     
     try:
-        response = requests.post(GROQ_API_URL, headers=headers, json={
+        request = _ACLIENT.build_request("POST", GROQ_API_URL, json={
             "model": MODEL_NAME,
             "messages": messages,
-            "temperature": hook_strength
-        }, timeout=30)
+            "temperature": hook_strength,
+            "stream": True
+        })
+        response = await _send_groq(request)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+                yield f"Error {response.status_code}: {response.text}", "", ""
+                return
+            
+            reply_chunks = []
+            audio_buf, visual_buf = [], []
+            tts_script, scenes = "", ""
+            # tag and body offset of the section still being streamed; earlier sections are already in the buffers
+            open_tag = None
+            # no tag can start before this offset, so each scan resumes here instead of rescanning the section
+            scan_from = 0
+            last_yield = 0.0
+            done = False
+            finish_reason = None
+            
+            async for line in response.aiter_lines():
+                if not line or not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    done = True
+                    break
+                
+                choice = json.loads(data)["choices"][0]
+                finish_reason = choice.get("finish_reason") or finish_reason
+                delta = choice["delta"].get("content")
+                if not delta:
+                    continue
+                reply_chunks.append(delta)
+                
+                # the chat needs the whole reply on every update, so only rebuild it a few times a second
+                now = time.monotonic()
+                if now - last_yield < _STREAM_YIELD_INTERVAL:
+                    continue
+                last_yield = now
+                full_reply = "".join(reply_chunks)
+                
+                # flush every finished section; a tag too close to the end may still grow into a longer one
+                flushed = False
+                for match in _TAG_RE.finditer(full_reply, scan_from):
+                    if match.start() + _MAX_TAG_LEN > len(full_reply):
+                        break
+                    if open_tag is not None:
+                        _add_section(open_tag[0], full_reply[open_tag[1]:match.start()], audio_buf, visual_buf)
+                        flushed = True
+                    open_tag = (match.lastgroup, match.end())
+                    scan_from = match.end()
+                scan_from = max(scan_from, len(full_reply) - _MAX_TAG_LEN)
+                if flushed:
+                    tts_script, scenes = "\n\n".join(audio_buf), "\n\n".join(visual_buf)
+                
+                yield full_reply, tts_script, scenes
+        finally:
+            await response.aclose()
         
-        if response.status_code == 200:
-            full_reply = response.json()["choices"][0]["message"]["content"]
-            tts_script, scenes = parse_script(full_reply)
-            return full_reply, tts_script, scenes
-        else:
-            return f"Error {response.status_code}: {response.text}", "", ""
+        full_reply = "".join(reply_chunks)
+        # only cache replies that ran to completion, never an empty or length-truncated one
+        if done and full_reply and finish_reason == "stop":
+            await asyncio.to_thread(_cache_put, cache_key, full_reply)
+        # show the finished reply right away; the tabs catch up once the final parse is done off the event loop
+        yield full_reply, tts_script, scenes
+        tts_script, scenes = await asyncio.to_thread(parse_script, full_reply)
+        yield full_reply, tts_script, scenes
     except Exception as e:
-        return f"Request failed: {str(e)}", "", ""
+        yield f"Request failed: {str(e)}", "", ""
 
 
 css = """
 footer {visibility: hidden}
 """
 
-with gr.Blocks() as demo:
+# gradio's own cached copies of downloads are cleared hourly
+with gr.Blocks(delete_cache=(3600, 3600)) as demo:
     gr.Markdown("# 🎬 ScriptForge AI: YouTube Script Master")
     gr.Markdown("Transform your video ideas into high-retention, audience-first scripts. *Powered by GROQ*")
     
@@ -138,6 +317,7 @@ with gr.Blocks() as demo:
                 value="Standard (5-10 mins)"
             )
             hook_strength = gr.Slider(minimum=0.1, maximum=1.5, value=0.7, step=0.1, label="Hook Strength (Creativity)")
+            bypass_cache = gr.Checkbox(label="Bypass cache (force regenerate)", value=False)
             generate_btn = gr.Button("🚀 Generate Script", variant="primary")
             clear = gr.Button("Clear")
 
@@ -160,22 +340,27 @@ with gr.Blocks() as demo:
   
     state = gr.State([{"role": "assistant", "content": "Hi, my name is Script Forge: your YouTube script writer. Give me a topic so I can show my creativity."}])
 
-    def respond_wrapper(topic, tone, duration, hook_strength, chat_history):
-        full_reply, tts_script, scenes = query_groq(topic, tone, duration, hook_strength, chat_history)
+    async def respond_wrapper(topic, tone, duration, hook_strength, bypass_cache, chat_history):
+        replies = query_groq(topic, tone, duration, hook_strength, chat_history[:], bypass_cache)
         chat_history.append({"role": "user", "content": topic})
-        chat_history.append({"role": "assistant", "content": full_reply})
-        return chat_history, tts_script, scenes
+        chat_history.append({"role": "assistant", "content": ""})
+        async for full_reply, tts_script, scenes in replies:
+            chat_history[-1]["content"] = full_reply
+            yield chat_history, tts_script, scenes
 
     generate_btn.click(
         respond_wrapper, 
-        [topic, tone, duration, hook_strength, state], 
-        [chatbot, tts_output, scenes_output]
+        [topic, tone, duration, hook_strength, bypass_cache, state], 
+        [chatbot, tts_output, scenes_output],
+        concurrency_limit=16
     )
     
+    download_path = gr.State(None, delete_callback=_remove_download)
+
     download_btn.click(
         save_to_file,
-        [tts_output],
-        [download_file]
+        [tts_output, download_path],
+        [download_file, download_path]
     )
     
     clear.click(